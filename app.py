@@ -1,13 +1,19 @@
+import io
+import os
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import plotly.io as pio
 from datetime import datetime, timedelta
-import folium
-from streamlit_folium import st_folium
-from folium import Icon
 import numpy as np
 
+# pandas Copy-on-Write (캐시로 공유되는 연도별 데이터가 실수로 수정되지 않도록 보호)
+pd.options.mode.copy_on_write = True
+
 # 페이지 설정
 st.set_page_config(page_title="서울시 대기질 모니터링", page_icon="🌫️", layout="wide")
 
@@ -26,64 +32,383 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# 데이터 로드 함수
-@st.cache_data
-def load_data():
-    """CSV 파일들을 로드하고 합치기"""
-    dfs = []
-    files = {
-        '2008-2011': 'seoul_air_20082011.csv',
-        '2012-2015': 'seoul_air_20122015.csv',
-        '2016-2019': 'seoul_air_20162019.csv',
-        '2020-2021': 'seoul_air_20202021.csv',
-        '2022': 'seoul_air_2022.csv'
+# 메모/즐겨찾기 저장 파일 (Arrow IPC)
+MEMO_FILE = 'memos.arrow'
+FAVORITE_FILE = 'favorites.arrow'
+
+# 서울시 구청 좌표
+district_coords = {
+    '종로구': [37.5735, 126.9790],
+    '중구': [37.5641, 126.9979],
+    '용산구': [37.5326, 126.9905],
+    '성동구': [37.5633, 127.0371],
+    '광진구': [37.5385, 127.0823],
+    '동대문구': [37.5744, 127.0400],
+    '중랑구': [37.6063, 127.0936],
+    '성북구': [37.5894, 127.0167],
+    '강북구': [37.6398, 127.0257],
+    '도봉구': [37.6687, 127.0471],
+    '노원구': [37.6543, 127.0568],
+    '은평구': [37.6175, 126.9227],
+    '서대문구': [37.5794, 126.9365],
+    '마포구': [37.5664, 126.9014],
+    '양천구': [37.5169, 126.8667],
+    '강서구': [37.5509, 126.8495],
+    '구로구': [37.4954, 126.8876],
+    '금천구': [37.4567, 126.8958],
+    '영등포구': [37.5264, 126.8962],
+    '동작구': [37.5124, 126.9393],
+    '관악구': [37.4782, 126.9516],
+    '서초구': [37.4837, 127.0324],
+    '강남구': [37.5172, 127.0473],
+    '송파구': [37.5145, 127.1058],
+    '강동구': [37.5301, 127.1238]
+}
+
+# 구분 사전(dictionary) 순서: 알려진 구역명 + '평균'을 정렬한 고정 순서
+# (데이터에 없는 이름이 있으면 그 뒤에 정렬해 추가하므로 아래 좌표 배열과 코드가 항상 일치)
+DISTRICT_CATEGORIES = sorted([*district_coords, '평균'])
+
+# 구역 좌표 배열 (구분 코드로 바로 인덱싱, 좌표가 없는 '평균'은 NaN)
+_COORD_LAT = np.array([district_coords.get(name, [np.nan, np.nan])[0] for name in DISTRICT_CATEGORIES], dtype=np.float32)
+_COORD_LON = np.array([district_coords.get(name, [np.nan, np.nan])[1] for name in DISTRICT_CATEGORIES], dtype=np.float32)
+
+# 원본 CSV 파일 목록
+CSV_FILES = {
+    '2008-2011': 'seoul_air_20082011.csv',
+    '2012-2015': 'seoul_air_20122015.csv',
+    '2016-2019': 'seoul_air_20162019.csv',
+    '2020-2021': 'seoul_air_20202021.csv',
+    '2022': 'seoul_air_2022.csv'
+}
+PARQUET_CACHE = 'seoul_air.parquet'
+PARQUET_COLUMNS = ['일시', '구분', 'PM10', 'PM25', '연도', '월', '일', '시간', '일자']
+# 캐시 형식이 바뀌면 올려서 기존 캐시를 다시 생성
+PARQUET_CACHE_VERSION = b'2'
+
+# 컬럼명 표준화 (괄호 제거)
+COLUMN_NAMES = {
+    '미세먼지(PM10)': 'PM10',
+    '초미세먼지(PM2.5)': 'PM25',
+    '초미세먼지(PM25)': 'PM25'
+}
+
+# CSV 읽기 옵션 (일시는 문자열로 읽은 뒤 변환, 잘못된 값은 결측 처리)
+CSV_CONVERT_OPTIONS = pacsv.ConvertOptions(
+    column_types={
+        '일시': pa.string(),
+        **{name: pa.float64() for name in COLUMN_NAMES}
     }
+)
+
+def _load_parquet_cache(path):
+    """CSV 파일들을 합친 테이블 반환 (CSV가 더 최신일 때만 Parquet 캐시 재생성)"""
+    csv_mtime = max((os.path.getmtime(file) for file in CSV_FILES.values() if os.path.exists(file)), default=0)
+    if os.path.exists(path) and os.path.getmtime(path) >= csv_mtime:
+        metadata = pq.read_schema(path).metadata or {}
+        if metadata.get(b'cache_version') == PARQUET_CACHE_VERSION:
+            return pq.read_table(path, columns=PARQUET_COLUMNS)
     
-    for period, file in files.items():
+    tables = []
+    failed = False
+    for period, file in CSV_FILES.items():
         try:
-            # UTF-8로 읽기
-            df = pd.read_csv(file, encoding='utf-8')
-            
-            # 컬럼명 표준화 (괄호 제거)
-            df = df.rename(columns={
-                '미세먼지(PM10)': 'PM10',
-                '초미세먼지(PM2.5)': 'PM25',
-                '초미세먼지(PM25)': 'PM25' 
-            })
-            
-            dfs.append(df)
+            table = pacsv.read_csv(file, convert_options=CSV_CONVERT_OPTIONS)
+            table = table.rename_columns([COLUMN_NAMES.get(name, name) for name in table.column_names])
+            table = table.set_column(
+                table.schema.get_field_index('일시'), '일시',
+                pc.strptime(table['일시'], format='%Y-%m-%d %H:%M', unit='s', error_is_null=True)
+            )
+            tables.append(table)
         except Exception as e:
+            failed = True
             st.error(f"파일 읽기 실패: {file} - {str(e)}")
     
-    if dfs:
-        data = pd.concat(dfs, ignore_index=True)
-        # 날짜 형식 변환
-        data['일시'] = pd.to_datetime(data['일시'], errors='coerce')
-        data = data.dropna(subset=['일시'])
-        data['연도'] = data['일시'].dt.year
-        data['월'] = data['일시'].dt.month
-        data['일'] = data['일시'].dt.day
-        data['시간'] = data['일시'].dt.hour
-        return data
-    else:
+    if not tables:
+        return None
+    
+    table = pa.concat_tables(tables)
+    table = table.filter(pc.is_valid(table['일시']))
+    
+    # 연/월/일/시는 캐시에 미리 계산해 두고, 구분은 정렬된 사전(dictionary)으로 인코딩
+    timestamps = table['일시']
+    extra_names = sorted(set(pc.unique(table['구분']).drop_null().to_pylist()) - set(DISTRICT_CATEGORIES))
+    categories = pa.array(DISTRICT_CATEGORIES + extra_names, type=pa.string())
+    district_codes = pc.index_in(table['구분'], value_set=categories).cast(pa.int16())
+    table = table.set_column(
+        table.schema.get_field_index('구분'), '구분',
+        pa.DictionaryArray.from_arrays(district_codes.combine_chunks(), categories)
+    )
+    table = table.append_column('연도', pc.year(timestamps).cast(pa.int16()))
+    table = table.append_column('월', pc.month(timestamps).cast(pa.int16()))
+    table = table.append_column('일', pc.day(timestamps).cast(pa.int16()))
+    table = table.append_column('시간', pc.hour(timestamps).cast(pa.int16()))
+    
+    # 날짜 범위 비교용 정수 키 (YYYYMMDD)
+    date_key = pc.add(
+        pc.add(pc.multiply(pc.year(timestamps), 10000), pc.multiply(pc.month(timestamps), 100)),
+        pc.day(timestamps)
+    )
+    table = table.append_column('일자', date_key.cast(pa.int32()))
+    
+    # 일시 오름차순 정렬 (최근 시각 데이터를 뒤쪽 슬라이스로 바로 찾기 위함)
+    table = table.sort_by('일시')
+    table = table.replace_schema_metadata({'cache_version': PARQUET_CACHE_VERSION})
+    
+    # 일부 파일을 읽지 못했으면 불완전한 데이터가 캐시로 남지 않도록 저장하지 않음
+    if not failed:
+        pq.write_table(table, path, compression='zstd')
+    return table.select(PARQUET_COLUMNS)
+
+# 메모 로드 함수
+def load_memos():
+    """저장된 메모 DataFrame 반환"""
+    if os.path.exists(MEMO_FILE):
+        return pd.read_feather(MEMO_FILE)
+    return pd.DataFrame({'date': pd.Series(dtype=str), 'memo': pd.Series(dtype=str)})
+
+# 메모 저장 함수
+def save_memo(memo_text):
+    """파일의 최신 메모에 새 메모를 추가해 저장한 DataFrame 반환"""
+    new_memo = pd.DataFrame([{
+        'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
+        'memo': memo_text
+    }])
+    # 세션에 들고 있는 사본이 아니라 디스크의 내용에 덧붙여 다른 세션의 메모를 덮어쓰지 않음
+    memos = pd.concat([load_memos(), new_memo], ignore_index=True)
+    memos.to_feather(MEMO_FILE)
+    return memos
+
+# 즐겨찾기 로드/저장 함수
+def load_favorites():
+    """저장된 즐겨찾기 구역 목록 반환"""
+    if os.path.exists(FAVORITE_FILE):
+        return pd.read_feather(FAVORITE_FILE)['구분'].tolist()
+    return []
+
+def save_favorites(favorites):
+    """즐겨찾기 구역 목록을 파일에 저장"""
+    pd.DataFrame({'구분': pd.Series(favorites, dtype=str)}).to_feather(FAVORITE_FILE)
+
+def add_favorite(district):
+    """디스크의 최신 목록에 구역을 추가해 저장한 목록 반환"""
+    favorites = load_favorites()
+    if district not in favorites:
+        favorites.append(district)
+        save_favorites(favorites)
+    return favorites
+
+def remove_favorite(district):
+    """디스크의 최신 목록에서 구역을 삭제해 저장한 목록 반환"""
+    favorites = load_favorites()
+    if district in favorites:
+        favorites.remove(district)
+        save_favorites(favorites)
+    return favorites
+
+# 데이터 로드 함수 (partition_by_year에서만 호출되므로 별도 캐시 없음)
+def load_data():
+    """Parquet 캐시에서 데이터 로드"""
+    table = _load_parquet_cache(PARQUET_CACHE)
+    if table is None:
         return pd.DataFrame()
+    
+    return table.to_pandas()
+
+# 연도별 분할 (앱 전체에서 한 번만 계산, 읽기 전용으로 공유)
+@st.cache_resource
+def partition_by_year():
+    """연도별 DataFrame 딕셔너리 반환"""
+    data = load_data()
+    return {year: group for year, group in data.groupby('연도', sort=False)}
+
+# 월별/시간대별 집계용 Polars 프레임 (연도별로 한 번만 변환해 공유, polars는 처음 필요할 때만 import)
+@st.cache_resource
+def polars_partition(year):
+    """해당 연도의 집계에 필요한 열만 담은 Polars DataFrame 반환"""
+    import polars as pl
+    return pl.from_pandas(partition_by_year()[year][['월', '시간', '구분', 'PM10', 'PM25']])
+
+# 대기질 등급 기준 (각 등급의 상한값, 상한값 포함)
+_PM10_BINS = np.array([30, 80, 150], dtype=np.int16)
+_PM25_BINS = np.array([15, 35, 75], dtype=np.int16)
+_LABELS = np.array(['좋음', '보통', '나쁨', '매우나쁨', '데이터없음'])
+
+# 지도 표시용 등급 인덱스별 색상 및 팝업 템플릿
+_GRADE_COLOR_IDX = ('blue', 'green', 'orange', 'red', 'gray')
+_POPUP_TMPL = '<div style="width: 200px;"><strong>{}</strong><br>평균 {}: {:.1f} ㎍/㎥<br>등급: {}</div>'
+
+# 대기질 등급 판정 함수 (벡터화)
+def grade_array(values, pollutant='PM10'):
+    """값 배열의 대기질 등급 배열 반환"""
+    values = np.asarray(values, dtype=np.float64)
+    bins = _PM10_BINS if pollutant == 'PM10' else _PM25_BINS
+    grade_idx = np.searchsorted(bins, values, side='left')
+    grade_idx[np.isnan(values)] = len(_LABELS) - 1
+    return _LABELS[grade_idx]
+
+# 구역별 평균/등급 계산 커널 (구역 코드 배열을 한 번만 순회, 실행 시에는 numba JIT 버전 사용)
+def district_means_and_grades(codes, values, n_cats, bins):
+    """구역 코드별 평균, 등급 인덱스, 행 개수 반환"""
+    sums = np.zeros(n_cats)
+    counts = np.zeros(n_cats, np.int64)
+    rows = np.zeros(n_cats, np.int64)
+    for i in range(codes.size):
+        c = codes[i]
+        if c < 0:
+            continue
+        rows[c] += 1
+        v = values[i]
+        if not np.isnan(v):
+            sums[c] += v
+            counts[c] += 1
+    
+    means = np.full(n_cats, np.nan)
+    grades = np.full(n_cats, bins.size + 1, np.int64)  # 데이터없음
+    for c in range(n_cats):
+        if counts[c] > 0:
+            means[c] = sums[c] / counts[c]
+            grades[c] = np.searchsorted(bins, means[c], side='left')
+    return means, grades, rows
+
+# 스크립트 재실행마다 새 디스패처를 만들지 않도록 프로세스 전체에서 공유
+@st.cache_resource
+def _jit_district_kernel():
+    """district_means_and_grades의 JIT 컴파일 버전 반환 (numba는 처음 필요할 때만 import)"""
+    from numba import njit
+    return njit(cache=True)(district_means_and_grades)
 
 # 대기질 등급 판정 함수
 def get_air_quality_grade(value, pollutant='PM10'):
     """대기질 등급 반환"""
-    if pd.isna(value):
-        return '데이터없음'
-    
-    if pollutant == 'PM10':
-        if value <= 30: return '좋음'
-        elif value <= 80: return '보통'
-        elif value <= 150: return '나쁨'
-        else: return '매우나쁨'
-    else:  # PM2.5
-        if value <= 15: return '좋음'
-        elif value <= 35: return '보통'
-        elif value <= 75: return '나쁨'
-        else: return '매우나쁨'
+    return str(grade_array([value], pollutant)[0])
+
+# 집계 함수 (필터 조합별 캐시)
+@st.cache_data
+def compute_aggs(_filtered_data, year, districts, pollutant):
+    """구역별 평균/등급, 월별/시간대별 평균 집계 반환"""
+    import polars as pl
+    districts_col = _filtered_data['구분']
+    categories = districts_col.cat.categories
+    means, grades, rows = _jit_district_kernel()(
+        districts_col.cat.codes.to_numpy(),
+        _filtered_data[pollutant].to_numpy(dtype=np.float64),
+        len(categories),
+        _PM10_BINS if pollutant == 'PM10' else _PM25_BINS
+    )
+    observed = rows > 0
+    district_avg = pd.Series(means[observed], index=categories[observed], name=pollutant).sort_values(ascending=False)
+    district_info = pd.DataFrame(
+        {'코드': np.flatnonzero(observed), '등급': grades[observed]},
+        index=categories[observed]
+    ).reindex(district_avg.index)
+    
+    # 월별/시간대별 평균은 두 lazy 쿼리를 collect_all로 함께 실행 (공통 필터는 한 번만 계산)
+    lf = polars_partition(year).lazy().filter(pl.col('구분').is_in(list(districts)))
+    monthly_trend, hourly_pattern = pl.collect_all([
+        lf.group_by(['월', '구분']).agg(pl.col(pollutant).mean())
+          .with_columns(pl.col('구분').cast(pl.Utf8)).sort(['월', '구분']),
+        lf.group_by('시간').agg(pl.col(pollutant).mean()).sort('시간')
+    ])
+    return district_avg, district_info, monthly_trend.to_pandas(), hourly_pattern.to_pandas()
+
+# 차트 생성 함수 (입력값별로 Plotly JSON 캐시, plotly는 캐시 미스일 때만 import)
+@st.cache_data(max_entries=8)
+def district_bar_json(districts, values, title, pollutant):
+    """구역별 평균 막대 차트 JSON 반환"""
+    import plotly.graph_objects as go
+    values = np.asarray(values, dtype=np.float64)
+    fig = go.Figure(go.Bar(
+        x=np.asarray(districts, dtype=object),
+        y=values,
+        marker=dict(
+            color=values,
+            colorscale=[[0, 'blue'], [0.33, 'green'], [0.66, 'yellow'], [1, 'red']],
+            showscale=True
+        )
+    ))
+    fig.update_layout(title=title, xaxis_title='구역', yaxis_title=f'{pollutant} (㎍/㎥)')
+    return fig.to_json()
+
+@st.cache_data(max_entries=8)
+def monthly_line_json(months, districts, values, title, pollutant):
+    """구역별 월별 추이 선 차트 JSON 반환"""
+    import plotly.express as px
+    fig = px.line(
+        pd.DataFrame({'월': months, '구분': districts, pollutant: values}),
+        x='월',
+        y=pollutant,
+        color='구분',
+        title=title,
+        labels={'월': '월', pollutant: f'{pollutant} (㎍/㎥)'}
+    )
+    return fig.to_json()
+
+@st.cache_data(max_entries=8)
+def hourly_bar_json(hours, values, title, pollutant):
+    """시간대별 평균 막대 차트 JSON 반환"""
+    import plotly.graph_objects as go
+    fig = go.Figure(go.Bar(
+        x=np.asarray(hours, dtype=np.int16),
+        y=np.asarray(values, dtype=np.float64)
+    ))
+    fig.update_layout(title=title, xaxis_title='시간', yaxis_title=f'{pollutant} (㎍/㎥)')
+    return fig.to_json()
+
+# 시계열 추이 차트의 전체 점 개수 상한 (선택한 구역들이 나눠 씀)
+TREND_MAX_POINTS = 2000
+
+@st.cache_data(max_entries=8)
+def trend_line_json(_date_filtered, year, districts, pollutant, date_lo, date_hi):
+    """구역별 시계열 추이 선 차트 JSON 반환 (구역별로 LTTB 다운샘플링)"""
+    import plotly.express as px
+    groups = [
+        (district, district_data.dropna(subset=[pollutant]))
+        for district, district_data in _date_filtered.groupby('구분', observed=True)
+    ]
+    if not groups:
+        return None
+    
+    n_out = max(TREND_MAX_POINTS // len(groups), 3)
+    trend_frames = []
+    for district, district_data in groups:
+        x, y = lttb(district_data['일시'].to_numpy(), district_data[pollutant].to_numpy(), n_out=n_out)
+        trend_frames.append(pd.DataFrame({'일시': x, '구분': district, pollutant: y}))
+    
+    fig = px.line(
+        pd.concat(trend_frames, ignore_index=True),
+        x='일시',
+        y=pollutant,
+        color='구분',
+        title=f"구역별 {pollutant} 농도 추이",
+        labels={'일시': '일시', pollutant: f'{pollutant} (㎍/㎥)'}
+    )
+    return fig.to_json()
+
+# CSV 다운로드 데이터 생성 함수 (최근 필터 조합 몇 개만 캐시, 연 단위 CSV는 10MB 이상)
+@st.cache_data(max_entries=4, ttl=600)
+def to_csv_bytes(_date_filtered, year, districts, date_lo, date_hi):
+    """선택한 데이터를 UTF-8(BOM) CSV 바이트로 변환"""
+    # 내부 비교용 일자 키는 내보내지 않음
+    table = pa.Table.from_pandas(_date_filtered.drop(columns='일자'), preserve_index=False)
+    table = table.set_column(
+        table.schema.get_field_index('일시'), '일시',
+        table['일시'].cast(pa.timestamp('s'))
+    )
+    # 기존 to_csv처럼 따옴표 없이 작성 (헤더는 pyarrow 버전과 무관하게 직접 작성)
+    buf = io.BytesIO()
+    buf.write(b'\xef\xbb\xbf' + ','.join(table.column_names).encode('utf-8') + b'\n')
+    pacsv.write_csv(table, buf, write_options=pacsv.WriteOptions(include_header=False, quoting_style='none'))
+    return buf.getvalue()
+
+# 시계열 다운샘플링 함수
+def lttb(x, y, n_out=2000):
+    """LTTB 알고리즘으로 시계열을 n_out개 점으로 줄이기 (x는 datetime64 배열)"""
+    if len(y) <= n_out:
+        return x, y
+    from tsdownsample import LTTBDownsampler
+    idx = LTTBDownsampler().downsample(x.view(np.int64), y, n_out=n_out)
+    return x[idx], y[idx]
 
 # 대기질 등급별 색상
 def get_grade_color(grade):
@@ -96,14 +421,47 @@ def get_grade_color(grade):
     }
     return colors.get(grade, '#808080')
 
+# 지도 생성 함수 (필터 조합별로 렌더링된 HTML 캐시, folium은 캐시 미스일 때만 import)
+@st.cache_data(ttl=3600)
+def build_map(pollutant, district_rows):
+    """구역별 평균 농도를 표시한 지도 HTML 반환 (district_rows: (구분 코드, 구역, 평균, 등급 인덱스) 튜플)"""
+    import folium
+    m = folium.Map(location=[37.5665, 126.9780], zoom_start=11)
+    
+    # 좌표가 있는 구역만 선택 (구분 코드로 좌표 배열 직접 인덱싱)
+    codes = np.array([code for code, _, _, _ in district_rows], dtype=np.int64)
+    names = np.array([district for _, district, _, _ in district_rows], dtype=object)
+    avgs = np.array([avg for _, _, avg, _ in district_rows], dtype=np.float64)
+    grade_idx = np.array([grade for _, _, _, grade in district_rows], dtype=np.int64)
+    has_coords = codes < _COORD_LAT.size
+    has_coords[has_coords] = ~np.isnan(_COORD_LAT[codes[has_coords]])
+    codes, names, avgs, grade_idx = codes[has_coords], names[has_coords], avgs[has_coords], grade_idx[has_coords]
+    
+    # 구역별 데이터 표시
+    for district, avg_pollution, lat, lon, grade in zip(
+            names, avgs, _COORD_LAT[codes], _COORD_LON[codes], grade_idx.tolist()):
+        color = _GRADE_COLOR_IDX[grade]
+        popup_html = _POPUP_TMPL.format(district, pollutant, avg_pollution, _LABELS[grade])
+        
+        folium.CircleMarker(
+            location=[round(float(lat), 4), round(float(lon), 4)],
+            radius=10,
+            popup=folium.Popup(popup_html, max_width=250),
+            color=color,
+            fill=True,
+            fillColor=color
+        ).add_to(m)
+    
+    return m.get_root().render()
+
 # 앱 제목
 st.title("🌫️ 서울시 대기질 실시간 모니터링 시스템")
 st.caption(f"2008년부터 2022년까지의 서울시 미세먼지 데이터 분석")
 
 # 데이터 로드
-data = load_data()
+partitions = partition_by_year()
 
-if data.empty:
+if not partitions:
     st.error("데이터를 불러올 수 없습니다. CSV 파일을 확인해주세요.")
     st.stop()
 
@@ -112,11 +470,11 @@ with st.sidebar:
     st.header("⚙️ 필터 설정")
     
     # 연도 선택
-    years = sorted(data['연도'].unique())
+    years = sorted(partitions)
     selected_year = st.selectbox("연도 선택", years, index=len(years)-1)
     
     # 구역 선택
-    districts = sorted(data['구분'].unique())
+    districts = sorted(partitions[years[-1]]['구분'].cat.categories)
     selected_districts = st.multiselect("구역 선택", districts, default=districts[:5])
     
     # 오염물질 선택
@@ -126,13 +484,12 @@ with st.sidebar:
     st.markdown("---")
     st.header("⭐ 즐겨찾기 구역")
     if "favorite_districts" not in st.session_state:
-        st.session_state.favorite_districts = []
+        st.session_state.favorite_districts = load_favorites()
     
     fav_district = st.selectbox("즐겨찾기 추가", districts)
     if st.button("추가"):
-        if fav_district not in st.session_state.favorite_districts:
-            st.session_state.favorite_districts.append(fav_district)
-            st.success(f"{fav_district} 추가됨")
+        st.session_state.favorite_districts = add_favorite(fav_district)
+        st.success(f"{fav_district} 추가됨")
     
     if st.session_state.favorite_districts:
         st.write("즐겨찾기 목록:")
@@ -140,14 +497,20 @@ with st.sidebar:
             col1, col2 = st.columns([3, 1])
             col1.write(f"• {dist}")
             if col2.button("삭제", key=f"del_{dist}"):
-                st.session_state.favorite_districts.remove(dist)
+                st.session_state.favorite_districts = remove_favorite(dist)
                 st.rerun()
 
 # 데이터 필터링
-filtered_data = data[
-    (data['연도'] == selected_year) & 
-    (data['구분'].isin(selected_districts))
-].copy()
+year_data = partitions[selected_year]
+district_codes = year_data['구분'].cat.codes.to_numpy()
+selected_codes = year_data['구분'].cat.categories.get_indexer(selected_districts)
+# 구역 코드 -> 선택 여부 lookup 테이블 (마지막 칸은 결측 코드 -1용으로 항상 False)
+selected_mask = np.zeros(len(year_data['구분'].cat.categories) + 1, dtype=bool)
+selected_mask[selected_codes[selected_codes >= 0]] = True
+filtered_data = year_data[selected_mask[district_codes]]
+district_avg, district_info, monthly_trend, hourly_pattern = compute_aggs(
+    filtered_data, selected_year, tuple(selected_districts), pollutant
+)
 
 # 메인 컨텐츠
 tab1, tab2, tab3, tab4 = st.tabs(["📊 실시간 현황", "📈 트렌드 분석", "🗺️ 지도 시각화", "📋 상세 데이터"])
@@ -156,129 +519,72 @@ with tab1:
     # 현재 상태 요약
     st.header("현재 대기질 상태")
     
-    # 최근 데이터만 추출
-    latest_data = filtered_data[filtered_data['일시'] == filtered_data['일시'].max()]
+    # 최근 데이터만 추출 (일시 기준 정렬되어 있으므로 마지막 시각의 뒤쪽 슬라이스)
+    latest_data = filtered_data.iloc[0:0]
+    if not filtered_data.empty:
+        latest_start = filtered_data['일시'].searchsorted(filtered_data['일시'].iloc[-1])
+        latest_data = filtered_data.iloc[latest_start:]
+    
+    latest_values = latest_data[pollutant].to_numpy(dtype=np.float64)
     
-    if not latest_data.empty:
+    # 빈 데이터이거나 모두 결측이면 표시하지 않음
+    if not np.isnan(latest_values).all():
         col1, col2, col3, col4 = st.columns(4)
         
-        avg_value = latest_data[pollutant].mean()
-        max_value = latest_data[pollutant].max()
-        min_value = latest_data[pollutant].min()
+        latest_districts = latest_data['구분'].to_numpy()
+        max_idx = np.nanargmax(latest_values)
+        min_idx = np.nanargmin(latest_values)
+        avg_value = np.nanmean(latest_values)
         
         col1.metric("평균", f"{avg_value:.1f} ㎍/㎥", 
                    delta=get_air_quality_grade(avg_value, pollutant))
-        col2.metric("최고", f"{max_value:.1f} ㎍/㎥",
-                   delta=latest_data[latest_data[pollutant] == max_value]['구분'].iloc[0])
-        col3.metric("최저", f"{min_value:.1f} ㎍/㎥",
-                   delta=latest_data[latest_data[pollutant] == min_value]['구분'].iloc[0])
+        col2.metric("최고", f"{latest_values[max_idx]:.1f} ㎍/㎥",
+                   delta=latest_districts[max_idx])
+        col3.metric("최저", f"{latest_values[min_idx]:.1f} ㎍/㎥",
+                   delta=latest_districts[min_idx])
         col4.metric("측정 시간", latest_data['일시'].iloc[0].strftime('%Y-%m-%d %H시'))
     
     # 구역별 현황
     st.subheader(f"구역별 {pollutant} 농도")
     
-    district_avg = filtered_data.groupby('구분')[pollutant].mean().sort_values(ascending=False)
-    
-    fig_bar = px.bar(
-        x=district_avg.index,
-        y=district_avg.values,
-        title=f"{selected_year}년 구역별 평균 {pollutant} 농도",
-        labels={'x': '구역', 'y': f'{pollutant} (㎍/㎥)'},
-        color=district_avg.values,
-        color_continuous_scale=['blue', 'green', 'yellow', 'red']
-    )
+    fig_bar = pio.from_json(district_bar_json(
+        tuple(district_avg.index),
+        tuple(district_avg),
+        f"{selected_year}년 구역별 평균 {pollutant} 농도",
+        pollutant
+    ))
     st.plotly_chart(fig_bar, use_container_width=True)
 
 with tab2:
     st.header("시계열 트렌드 분석")
     
     # 월별 트렌드
-    monthly_trend = filtered_data.groupby(['월', '구분'])[pollutant].mean().reset_index()
-    
-    fig_line = px.line(
-        monthly_trend,
-        x='월',
-        y=pollutant,
-        color='구분',
-        title=f"{selected_year}년 월별 {pollutant} 농도 변화",
-        labels={'월': '월', pollutant: f'{pollutant} (㎍/㎥)'}
-    )
+    fig_line = pio.from_json(monthly_line_json(
+        tuple(monthly_trend['월']),
+        tuple(monthly_trend['구분']),
+        tuple(monthly_trend[pollutant]),
+        f"{selected_year}년 월별 {pollutant} 농도 변화",
+        pollutant
+    ))
     st.plotly_chart(fig_line, use_container_width=True)
     
     # 시간대별 패턴
-    hourly_pattern = filtered_data.groupby(['시간'])[pollutant].mean().reset_index()
-    
-    fig_hour = px.bar(
-        hourly_pattern,
-        x='시간',
-        y=pollutant,
-        title=f"시간대별 평균 {pollutant} 농도",
-        labels={'시간': '시간', pollutant: f'{pollutant} (㎍/㎥)'}
-    )
+    fig_hour = pio.from_json(hourly_bar_json(
+        tuple(hourly_pattern['시간']),
+        tuple(hourly_pattern[pollutant]),
+        f"시간대별 평균 {pollutant} 농도",
+        pollutant
+    ))
     st.plotly_chart(fig_hour, use_container_width=True)
 
 with tab3:
     st.header("지도 시각화")
     
-    # 서울시 구청 좌표
-    district_coords = {
-        '종로구': [37.5735, 126.9790],
-        '중구': [37.5641, 126.9979],
-        '용산구': [37.5326, 126.9905],
-        '성동구': [37.5633, 127.0371],
-        '광진구': [37.5385, 127.0823],
-        '동대문구': [37.5744, 127.0400],
-        '중랑구': [37.6063, 127.0936],
-        '성북구': [37.5894, 127.0167],
-        '강북구': [37.6398, 127.0257],
-        '도봉구': [37.6687, 127.0471],
-        '노원구': [37.6543, 127.0568],
-        '은평구': [37.6175, 126.9227],
-        '서대문구': [37.5794, 126.9365],
-        '마포구': [37.5664, 126.9014],
-        '양천구': [37.5169, 126.8667],
-        '강서구': [37.5509, 126.8495],
-        '구로구': [37.4954, 126.8876],
-        '금천구': [37.4567, 126.8958],
-        '영등포구': [37.5264, 126.8962],
-        '동작구': [37.5124, 126.9393],
-        '관악구': [37.4782, 126.9516],
-        '서초구': [37.4837, 127.0324],
-        '강남구': [37.5172, 127.0473],
-        '송파구': [37.5145, 127.1058],
-        '강동구': [37.5301, 127.1238]
-    }
-    
-    # 지도 생성
-    m = folium.Map(location=[37.5665, 126.9780], zoom_start=11)
-    
-    # 구역별 데이터 표시
-    for district in selected_districts:
-        if district in district_coords:
-            district_data = filtered_data[filtered_data['구분'] == district]
-            if not district_data.empty:
-                avg_pollution = district_data[pollutant].mean()
-                grade = get_air_quality_grade(avg_pollution, pollutant)
-                color = 'blue' if grade == '좋음' else 'green' if grade == '보통' else 'orange' if grade == '나쁨' else 'red'
-                
-                popup_html = f"""
-                <div style="width: 200px;">
-                    <strong>{district}</strong><br>
-                    평균 {pollutant}: {avg_pollution:.1f} ㎍/㎥<br>
-                    등급: {grade}
-                </div>
-                """
-                
-                folium.CircleMarker(
-                    location=district_coords[district],
-                    radius=10,
-                    popup=folium.Popup(popup_html, max_width=250),
-                    color=color,
-                    fill=True,
-                    fillColor=color
-                ).add_to(m)
-    
-    st_folium(m, width=700, height=500)
+    # 지도 생성 (구역별 평균/등급 집계 재사용)
+    map_html = build_map(pollutant, tuple(zip(
+        district_info['코드'], district_avg.index, district_avg, district_info['등급']
+    )))
+    components.html(map_html, width=700, height=500)
 
 with tab4:
     st.header("상세 데이터")
@@ -292,22 +598,30 @@ with tab4:
     )
     
     # 선택한 날짜 범위의 데이터
+    date_lo = date_range[0].year * 10000 + date_range[0].month * 100 + date_range[0].day
+    date_hi = date_range[-1].year * 10000 + date_range[-1].month * 100 + date_range[-1].day
     date_filtered = filtered_data[
-        (filtered_data['일시'].dt.date >= date_range[0]) &
-        (filtered_data['일시'].dt.date <= date_range[1])
+        (filtered_data['일자'] >= date_lo) &
+        (filtered_data['일자'] <= date_hi)
     ]
     
     # 통계 요약
     st.subheader("통계 요약")
-    summary_stats = date_filtered.groupby('구분')[pollutant].agg(['mean', 'max', 'min', 'std']).round(1)
+    summary_stats = date_filtered.groupby('구분', observed=True)[pollutant].agg(['mean', 'max', 'min', 'std']).round(1)
     st.dataframe(summary_stats, use_container_width=True)
     
+    # 시계열 추이 (선택한 구역 전체를 TREND_MAX_POINTS개 점 이내로 다운샘플링)
+    st.subheader("시계열 추이")
+    trend_json = trend_line_json(date_filtered, selected_year, tuple(selected_districts), pollutant, date_lo, date_hi)
+    if trend_json is not None:
+        st.plotly_chart(pio.from_json(trend_json), use_container_width=True)
+    
     # 원본 데이터
     with st.expander("원본 데이터 보기"):
         st.dataframe(date_filtered[['일시', '구분', pollutant]], use_container_width=True)
     
     # 다운로드 버튼
-    csv = date_filtered.to_csv(index=False, encoding='utf-8-sig')
+    csv = to_csv_bytes(date_filtered, selected_year, tuple(selected_districts), date_lo, date_hi)
     st.download_button(
         label="📥 데이터 다운로드 (CSV)",
         data=csv,
@@ -319,19 +633,13 @@ with tab4:
 st.markdown("---")
 st.header("📝 분석 메모")
 memo_text = st.text_area("대기질 분석에 대한 메모를 작성하세요", height=100)
+if "memos" not in st.session_state:
+    st.session_state.memos = load_memos()
 if st.button("메모 저장"):
-    if "memos" not in st.session_state:
-        st.session_state.memos = []
-    st.session_state.memos.append({
-        'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
-        'memo': memo_text
-    })
+    st.session_state.memos = save_memo(memo_text)
     st.success("메모가 저장되었습니다")
 
-# 저장된 메모 표시
-if "memos" in st.session_state and st.session_state.memos:
+# 저장된 메모 표시 (한 번의 dataframe 렌더링)
+if not st.session_state.memos.empty:
     with st.expander("저장된 메모 보기"):
-        for memo in st.session_state.memos:
-            st.write(f"**{memo['date']}**")
-            st.write(memo['memo'])
-            st.markdown("---")
+        st.dataframe(st.session_state.memos, use_container_width=True, hide_index=True)